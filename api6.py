@@ -2,76 +2,210 @@ from fastapi import FastAPI
 from dotenv import load_dotenv
 import os
 import hashlib
-import json
+import functools
+import ijson
 import threading
+import asyncio
+import fcntl
+from contextlib import asynccontextmanager
+import numpy as np
+import torch
 from pydantic import BaseModel
-from typing import List
-from pinecone import Pinecone, ServerlessSpec
+from typing import Dict, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC
 from sentence_transformers import SentenceTransformer
 import google.generativeai as genai
 
 # ---------- Load Env & Keys ----------
 load_dotenv()
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 index_name = "shlrag"
 
 GENAI_MODEL_ID = "models/gemini-1.5-flash-latest"
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+ATS_SYSTEM_INSTRUCTION = (
+    "You are an ATS evaluator. Compare the resume to the job description (JD) "
+    "and score 0-100 on skills, experience and keyword match. If the JD omits "
+    "an experience requirement, favor more experienced candidates. Output strictly:\n"
+    "1. ATS Match Score: X%\n"
+    "2. A markdown table: | Category | Matched Skills/Keywords | Missing Skills/Keywords | Comments |"
+)
+ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+UPSERT_WORKERS = 8
+CORPUS_HASH_ID = "__corpus_hash__"
+META_NAMESPACE = "__meta__"
+RECOMMENDATION_FORMAT = "key-value-v1"
+INDEX_LOCK_PATH = "/tmp/rh_indexed.lock"
 
 # ---------- Initialize Models ----------
 genai.configure(api_key=GEMINI_API_KEY)
-generation_model = genai.GenerativeModel(GENAI_MODEL_ID)
-embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+generation_model = genai.GenerativeModel(GENAI_MODEL_ID, system_instruction=ATS_SYSTEM_INSTRUCTION)
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+if DEVICE == "cuda":
+    embedding_model = SentenceTransformer(
+        EMBEDDING_MODEL_NAME,
+        device=DEVICE,
+        tokenizer_kwargs={"use_fast": True}
+    )
+    embedding_model.half()
+    EMBEDDING_BACKEND = "torch-fp16"
+else:
+    # CPU deploys run the int8-quantized ONNX export through ONNX Runtime.
+    # Its intra-op thread pool is left at the default (physical cores).
+    embedding_model = SentenceTransformer(
+        EMBEDDING_MODEL_NAME,
+        device=DEVICE,
+        backend="onnx",
+        model_kwargs={
+            "file_name": ONNX_INT8_FILE,
+            "provider": "CPUExecutionProvider"
+        },
+        tokenizer_kwargs={"use_fast": True}
+    )
+    EMBEDDING_BACKEND = f"onnx:{ONNX_INT8_FILE}"
 
 # ---------- Initialize Pinecone ----------
-pc = Pinecone(api_key=PINECONE_API_KEY)
+pc = PineconeGRPC(api_key=PINECONE_API_KEY)
 index = pc.Index(index_name)
 
 # ---------- Initialize FastAPI ----------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up the tokenizer and model kernels before serving requests, then
+    # index job data in the background once the event loop is running. The
+    # indexer is a daemon thread so shutdown doesn't wait for a full upsert.
+    await asyncio.to_thread(warm_up_embedding_model)
+    threading.Thread(target=auto_push_job_data, daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+# ---------- ATS Result Cache ----------
+# In-process and per worker: under multiple Gunicorn/Uvicorn workers each one
+# keeps its own cache, so hit rates drop accordingly. Move this to a shared
+# store (e.g. Redis) if the service is scaled out.
+ATS_CACHE_SIZE = 256
+ATS_SEMANTIC_THRESHOLD = 0.97
+ats_cache: Dict[str, str] = OrderedDict()
+ats_semantic_cache = []  # (resume_hash, normalized JD embedding, output)
+ats_cache_lock = threading.Lock()
 
 # ---------- Utility Functions ----------
+# Small on purpose: cached keys keep whole resume/JD strings alive.
+@functools.lru_cache(maxsize=32)
 def generate_hash(text):
-    return hashlib.sha256(text.encode()).hexdigest()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Bump RECOMMENDATION_FORMAT when changing this so the corpus is re-indexed.
+def format_recommendation(rec):
+    # Plain "key: value" lines embed with fewer MiniLM tokens than a JSON blob.
+    if not isinstance(rec, dict):
+        return str(rec)
+    return "\n".join(
+        f"{key}: {', '.join(map(str, value)) if isinstance(value, list) else value}"
+        for key, value in rec.items()
+    )
 
-def prepare_jsons_for_rag(json_paths):
-    items = []
+def prepare_jsons_for_rag(json_paths, chunk_size=2000):
+    # Streams jobs with ijson and yields parallel id/text lists of up to
+    # chunk_size recommendations, so the full JSON files are never held in
+    # memory.
+    chunk = {"ids": [], "texts": []}
     global_index = 0
     for json_path in json_paths:
-        filename = os.path.basename(json_path)
-        with open(json_path, "r", encoding="utf-8") as f:
-            job_data = json.load(f)
-        for job in job_data:
-            slug = job.get("slug", f"job-{global_index}")
-            for rec in job.get("recommendations", []):
-                text = json.dumps(rec)
-                unique_id = f"{slug}-{global_index}"
-                items.append({
-                    "id": unique_id,
-                    "line": text,
-                    "filename": filename,
-                    "page_number": "1"
-                })
-                global_index += 1
-    return {"items": items}
-
-def upsert_documents(documents, batch_size=50):
-    vectors = []
-    for doc in documents:
-        embedding = embedding_model.encode(doc["line"]).tolist()
-        vectors.append({
-            "id": doc["id"],
-            "values": embedding,
-            "metadata": {"text": doc["line"]}
-        })
-
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i+batch_size]
-        print(f"Upserting batch {i//batch_size + 1} of {len(vectors)//batch_size + 1}")
-        index.upsert(vectors=batch)
-
-    return [doc["id"] for doc in documents]
+        with open(json_path, "rb") as f:
+            for job in ijson.items(f, "item", use_float=True):
+                slug = job.get("slug", f"job-{global_index}")
+                for rec in job.get("recommendations", []):
+                    chunk["ids"].append(f"{slug}-{global_index}")
+                    chunk["texts"].append(format_recommendation(rec))
+                    global_index += 1
+                    if len(chunk["ids"]) >= chunk_size:
+                        yield chunk
+                        chunk = {"ids": [], "texts": []}
+    if chunk["ids"]:
+        yield chunk
+
+def embed_texts(texts):
+    # encode() already length-sorts its inputs into batches (smart batching)
+    # and restores the original order.
+    embeddings = embedding_model.encode(
+        texts,
+        batch_size=64,
+        device=DEVICE,
+        convert_to_numpy=True,
+        normalize_embeddings=False,
+        show_progress_bar=False
+    )
+    return embeddings.astype(np.float32)
+
+def upsert_documents(ids, texts, batch_size=100):
+    if not ids:
+        return []
+
+    # (id, values, metadata) tuples sent over gRPC, which skips the JSON
+    # encoding of the REST client.
+    vectors = list(zip(ids, embed_texts(texts), [{"text": text} for text in texts]))
+
+    batches = [vectors[i:i+batch_size] for i in range(0, len(vectors), batch_size)]
+    print(f"Upserting {len(batches)} batches")
+    with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+        list(executor.map(lambda batch: index.upsert(vectors=batch), batches))
+
+    return list(ids)
+
+def warm_up_embedding_model():
+    embedding_model.encode(["warmup"] * 8, batch_size=8, device=DEVICE, show_progress_bar=False)
+
+def embed_query(text):
+    # MiniLM truncates at max_seq_length tokens, so longer texts that differ
+    # only past that point would embed identically. Return None for those so
+    # callers fall back to exact matching.
+    max_length = embedding_model.max_seq_length
+    token_ids = embedding_model.tokenizer(text, truncation=True, max_length=max_length + 1)["input_ids"]
+    if len(token_ids) > max_length:
+        return None
+    embedding = embedding_model.encode(
+        [text],
+        device=DEVICE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return embedding[0].astype(np.float32)
+
+def get_cached_ats(key):
+    with ats_cache_lock:
+        if key not in ats_cache:
+            return None
+        ats_cache.move_to_end(key)
+        return ats_cache[key]
+
+def find_similar_ats(resume_hash, jd_embedding):
+    with ats_cache_lock:
+        candidates = [entry for entry in ats_semantic_cache if entry[0] == resume_hash]
+    if not candidates:
+        return None
+    scores = np.stack([entry[1] for entry in candidates]) @ jd_embedding
+    best = int(np.argmax(scores))
+    if scores[best] > ATS_SEMANTIC_THRESHOLD:
+        return candidates[best][2]
+    return None
+
+def cache_ats(key, resume_hash, jd_embedding, output):
+    with ats_cache_lock:
+        ats_cache[key] = output
+        if jd_embedding is not None:
+            ats_semantic_cache.append((resume_hash, jd_embedding, output))
+        if len(ats_cache) > ATS_CACHE_SIZE:
+            ats_cache.popitem(last=False)
+        if len(ats_semantic_cache) > ATS_CACHE_SIZE:
+            ats_semantic_cache.pop(0)
 
 # ---------- Pydantic Models ----------
 class Item(BaseModel):
@@ -91,51 +225,34 @@ class ATSCheck(BaseModel):
 @app.post("/push_docs/")
 async def push_docs(item: Docs):
     try:
-        docs = item.dict()["items"]
-        ids = upsert_documents(docs)
+        ids = upsert_documents(
+            [doc.id for doc in item.items],
+            [doc.line for doc in item.items]
+        )
         print("Inserted IDs:", ids)
         return {"status": "success", "inserted_ids": ids}
     except Exception as e:
         return {"error": str(e)}
 
+# Plain def so FastAPI runs it in its threadpool and concurrent Gemini
+# calls don't block the event loop.
 @app.post("/ats_check/")
-async def ats_check(item: ATSCheck):
+def ats_check(item: ATSCheck):
     try:
-        prompt =  f"""
-        You are an ATS (Applicant Tracking System) evaluation AI.
-
-        Your behavior rules:
-        - **ATS Match Score must be between 0 and 100 only.**
-        - Focus primarily on matching **skills, experiences, and keywords** from the Job Description (JD).
-        - If the JD **does NOT mention any experience requirement**, prefer candidates with **more overall experience** and award a slightly higher score.
-        - Never return an ATS score above 100%.
-
-        Compare the following Resume and Job Description:
-
-        - Resume:
-        {item.resume_text}
-
-        - Job Description:
-        {item.job_description}
-
-        **Your Task:**
-        1. Assign an **ATS Match Score (0-100)** based on the above rules.
-        2. Create a detailed table:
-
-        | Category | Matched Skills/Keywords | Missing Skills/Keywords | Comments |
-
-        Focus points:
-        - Skills and keywords alignment.
-        - Relevant experiences mentioned.
-        - If no experience is specified in JD, reward candidates with greater experience.
-
-        **Output format (strictly):**
-        1. ATS Match Score: __%
-        2. Table:
-        """
-
+        resume_hash = generate_hash(item.resume_text)
+        key = f"{resume_hash}:{generate_hash(item.job_description)}"
+        cached = get_cached_ats(key)
+        if cached is not None:
+            return {"output": cached}
+        jd_embedding = embed_query(item.job_description)
+        if jd_embedding is not None:
+            cached = find_similar_ats(resume_hash, jd_embedding)
+            if cached is not None:
+                return {"output": cached}
 
+        prompt = f"Resume:\n{item.resume_text}\n\nJob Description:\n{item.job_description}"
         response = generation_model.generate_content(prompt)
+        cache_ats(key, resume_hash, jd_embedding, response.text)
         return {"output": response.text}
     except Exception as e:
         return {"error": str(e)}
@@ -144,25 +261,76 @@ async def ats_check(item: ATSCheck):
 async def clear_pinecone():
     try:
         index.delete(delete_all=True)
+        clear_indexed_corpus_hash()
         return {"status": "success", "message": "Pinecone index cleared."}
     except Exception as e:
         return {"error": str(e)}
 
 # ---------- Startup Loader ----------
+def compute_corpus_hash(json_paths):
+    stamps = sorted(f"{p}:{os.path.getmtime(p)}:{os.path.getsize(p)}" for p in json_paths)
+    # Anything that changes the stored vectors or text must be part of the hash.
+    config = [EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, RECOMMENDATION_FORMAT]
+    return generate_hash("|".join(config + stamps))
+
+def get_indexed_corpus_hash():
+    vectors = index.fetch(ids=[CORPUS_HASH_ID], namespace=META_NAMESPACE).vectors
+    if CORPUS_HASH_ID not in vectors:
+        return None
+    return (vectors[CORPUS_HASH_ID].metadata or {}).get("corpus_hash")
+
+def set_indexed_corpus_hash(corpus_hash):
+    # Kept in its own namespace so queries against the job vectors never see
+    # it. Pinecone rejects all-zero dense vectors, hence the unit vector.
+    dimension = embedding_model.get_sentence_embedding_dimension()
+    index.upsert(vectors=[{
+        "id": CORPUS_HASH_ID,
+        "values": [1.0] + [0.0] * (dimension - 1),
+        "metadata": {"corpus_hash": corpus_hash}
+    }], namespace=META_NAMESPACE)
+    # Older deploys wrote the sentinel next to the job vectors.
+    index.delete(ids=[CORPUS_HASH_ID])
+
+def count_indexed_vectors():
+    # Job vectors live in the default ("") namespace.
+    namespace = index.describe_index_stats().namespaces.get("")
+    return namespace.vector_count if namespace else 0
+
+def clear_indexed_corpus_hash():
+    if META_NAMESPACE in index.describe_index_stats().namespaces:
+        index.delete(ids=[CORPUS_HASH_ID], namespace=META_NAMESPACE)
+
 def auto_push_job_data():
+    # Only one worker indexes at a time; the others see the lock held and skip.
+    try:
+        with open(INDEX_LOCK_PATH, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("⏭️ Job data is being indexed by another worker.")
+                return
+            push_job_data()
+    except Exception as e:
+        print("❌ Error pushing job data:", str(e))
+
+def push_job_data():
     try:
         file_path = "job_descriptions.json"
         if os.path.exists(file_path):
-            print("📤 Indexing job_descriptions.json into Pinecone...")
             json_files = ["job_descriptions.json", "job_descriptions_1.json"]
-            data = prepare_jsons_for_rag(json_files)
-            from fastapi.testclient import TestClient
-            client = TestClient(app)
-            response = client.post("/push_docs/", json=data)
-            print("✅ Job data indexed:", response.json())
+            corpus_hash = compute_corpus_hash(json_files)
+            # The sentinel survives a wipe of the job namespace done outside
+            # /clear_pinecone/, so also require the vectors to be there.
+            if get_indexed_corpus_hash() == corpus_hash and count_indexed_vectors() > 0:
+                print("✅ Job data already indexed, skipping.")
+                return
+            print("📤 Indexing job_descriptions.json into Pinecone...")
+            ids = []
+            for chunk in prepare_jsons_for_rag(json_files):
+                ids.extend(upsert_documents(chunk["ids"], chunk["texts"]))
+            set_indexed_corpus_hash(corpus_hash)
+            print("✅ Job data indexed:", len(ids))
         else:
             print("⚠️ job_descriptions.json not found.")
     except Exception as e:
         print("❌ Error pushing job data:", str(e))
-
-threading.Thread(target=auto_push_job_data, daemon=True).start()
@@ -1,19 +1,45 @@
+import os
+import hashlib
+import threading
+import multiprocessing
+import re
 import streamlit as st
 import requests
-import pdfplumber
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pdf_utils import extract_text_from_pdf
 
 API_BASE = "https://resumehunter.onrender.com"
+SCORE_RE = re.compile(r"ATS Match Score[^0-9]*(\d{1,3})")
+PDF_CACHE_SIZE = 256
 
 # ---------- API Helpers ----------
 def ats_check(resume_text, job_description):
-    try:
-        payload = {"resume_text": resume_text, "job_description": job_description}
-        res = requests.post(f"{API_BASE}/ats_check/", json=payload)
-        res.raise_for_status()
-        return res.json().get("output", "No ATS check output.")
-    except Exception as e:
-        st.error(f"Error fetching ATS check: {e}")
-        return "Error occurred during ATS check."
+    payload = {"resume_text": resume_text, "job_description": job_description}
+    res = requests.post(f"{API_BASE}/ats_check/", json=payload)
+    res.raise_for_status()
+    return res.json().get("output", "No ATS check output.")
+
+def ats_check_all(resume_texts, job_description):
+    # Requests run concurrently; errors are reported from the script thread
+    # since worker threads can't write to the Streamlit page.
+    def check(resume_text):
+        try:
+            return ats_check(resume_text, job_description)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(8, len(resume_texts))) as executor:
+        results = list(executor.map(check, resume_texts))
+
+    outputs = []
+    for result in results:
+        if isinstance(result, Exception):
+            st.error(f"Error fetching ATS check: {result}")
+            result = "Error occurred during ATS check."
+        outputs.append(result)
+    return outputs
 
 def clear_pinecone():
     try:
@@ -25,10 +51,55 @@ def clear_pinecone():
         return "Error occurred during clearing."
 
 # ---------- PDF Helper ----------
-def extract_text_from_pdf(file):
-    with pdfplumber.open(file) as pdf:
-        pages = [page.extract_text() for page in pdf.pages if page.extract_text()]
-    return "\n".join(pages)
+@st.cache_resource
+def get_pdf_pool():
+    # One pool for the server's lifetime; spawned (not forked) workers so the
+    # children don't inherit Streamlit's threads.
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def map_pdf_pool(files_bytes):
+    # A worker that crashes in native PDFium code (segfault, OOM kill) breaks
+    # the cached pool for good, so replace it and retry once.
+    try:
+        return list(get_pdf_pool().map(extract_text_from_pdf, files_bytes))
+    except BrokenProcessPool:
+        get_pdf_pool.clear()
+    try:
+        return list(get_pdf_pool().map(extract_text_from_pdf, files_bytes))
+    except BrokenProcessPool:
+        get_pdf_pool.clear()
+        raise
+
+@st.cache_resource
+def get_pdf_text_cache():
+    # Extracted text keyed by the sha256 of each PDF's bytes, shared across
+    # sessions like st.cache_data.
+    return OrderedDict(), threading.Lock()
+
+def extract_texts_from_pdfs(files_bytes):
+    cache, lock = get_pdf_text_cache()
+    keys = [hashlib.sha256(data).hexdigest() for data in files_bytes]
+    texts = {}
+    with lock:
+        for key in keys:
+            if key in cache:
+                cache.move_to_end(key)
+                texts[key] = cache[key]
+
+    # Only files not seen before go to the process pool.
+    misses = {key: data for key, data in zip(keys, files_bytes) if key not in texts}
+    if misses:
+        texts.update(zip(misses, map_pdf_pool(list(misses.values()))))
+        with lock:
+            for key in misses:
+                cache[key] = texts[key]
+            while len(cache) > PDF_CACHE_SIZE:
+                cache.popitem(last=False)
+
+    return [texts[key] for key in keys]
 
 # ---------- UI Setup ----------
 st.set_page_config(page_title="ATS Resume Checker", page_icon="🤖")
@@ -51,17 +122,12 @@ with st.form("ats_form"):
     if submitted and jd_text and uploaded_files:
         results = []
         with st.spinner("Processing Resumes..."):
-            for file in uploaded_files:
-                resume_text = extract_text_from_pdf(file)
-                ats_result = ats_check(resume_text, jd_text)
-                
+            resume_texts = extract_texts_from_pdfs([file.getvalue() for file in uploaded_files])
+            ats_results = ats_check_all(resume_texts, jd_text)
+            for file, ats_result in zip(uploaded_files, ats_results):
                 # Try to extract ATS Score
-                score = 0
-                try:
-                    score_line = [line for line in ats_result.splitlines() if "ATS Match Score" in line][0]
-                    score = int(''.join(filter(str.isdigit, score_line)))
-                except:
-                    pass
+                match = SCORE_RE.search(ats_result)
+                score = int(match.group(1)) if match else 0
 
                 results.append({
                     "filename": file.name,
@@ -0,0 +1,18 @@
+import io
+import pdfplumber
+import pypdfium2 as pdfium
+
+# Kept in its own module so process-pool workers can import it by name
+# (functions defined in the Streamlit script are not picklable).
+def extract_text_from_pdf(data):
+    try:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            pages = [page.get_textpage().get_text_range() for page in pdf]
+        finally:
+            pdf.close()
+    except Exception:
+        # Fall back to pdfplumber for PDFs that PDFium can't parse.
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            pages = [page.extract_text() for page in pdf.pages]
+    return "\n".join(page for page in pages if page)